@@ -1,19 +1,29 @@
 from __future__ import annotations
 
+import heapq
+import itertools
+import json
+import os
+import sys
+import tempfile
 import threading
 import time
-import uuid
 from base64 import b64encode
 from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import Optional
+from typing import NamedTuple, Optional
 
+from botocore.config import Config
 from dramatiq import Message
 from dramatiq.logging import get_logger
 from dramatiq_sqs import SQSBroker
 
+# Slotted dataclasses (Python 3.10+) have no per-instance __dict__, which adds up when many messages fail
+_DATACLASS_SLOTS = {"slots": True} if sys.version_info >= (3, 10) else {}
 
-@dataclass
+
+@dataclass(**_DATACLASS_SLOTS)
 class FailedMessage:
     """Track retry information for failed messages"""
 
@@ -23,6 +33,13 @@ class FailedMessage:
     last_failure_time: float = field(default_factory=time.time)
 
 
+class QueueConfig(NamedTuple):
+    """Resolved batching settings for a single queue"""
+
+    batch_interval: float
+    idle_timeout: float
+
+
 class BatchSQSBroker(SQSBroker):
     def __init__(
         self,
@@ -34,6 +51,7 @@ class BatchSQSBroker(SQSBroker):
         group_idle_timeouts: dict[str, float] = None,
         max_buffer_size_per_queue: int = 5000,
         max_retry_attempts: int = 3,
+        max_concurrent_flushes: int = 5,
         **kwargs,
     ):
         """
@@ -44,10 +62,21 @@ class BatchSQSBroker(SQSBroker):
         :param batch_size: Maximum messages per batch (max 10, SQS limit).
         :param group_batch_intervals: Per-group (queue_name) max wait times, e.g., {"high_priority": 0, "low_priority": 1.0}.
         :param group_idle_timeouts: Per-group idle timeouts, e.g., {"low_priority": 0.2}.
-        :param max_buffer_size_per_queue: Maximum buffer size per queue (default 5000).
+        :param max_buffer_size_per_queue: Maximum messages held per queue, including unsent batches (default 5000).
         :param max_retry_attempts: Maximum retry attempts for failed messages (default 3).
+        :param max_concurrent_flushes: Maximum number of batches being sent to SQS at the same time (default 5).
         :param args, kwargs: Arguments passed to SQSBroker (e.g., namespace).
+
+        The interval and timeout settings are resolved once per queue, on its first use,
+        so changing them after the broker has been created has no effect.
         """
+        # Keep TCP connections to SQS alive between flushes, with a pooled connection for every send thread;
+        # a custom botocore config takes precedence
+        client_config = Config(tcp_keepalive=True, max_pool_connections=max(10, max_concurrent_flushes))
+        if kwargs.get("config") is not None:
+            client_config = client_config.merge(kwargs["config"])
+        kwargs["config"] = client_config
+
         super().__init__(*args, **kwargs)
         self.logger = get_logger(__name__, type(self))
         self.default_batch_interval = default_batch_interval
@@ -63,6 +92,8 @@ class BatchSQSBroker(SQSBroker):
         self.failed_messages: dict[str, list[FailedMessage]] = defaultdict(list)  # Failed message tracking
         self.last_flush: dict[str, float] = {}  # Record last send time by queue name
         self.last_message_time: dict[str, float] = {}  # Record last message entry time
+        self._queue_configs: dict[str, QueueConfig] = {}  # Resolved per-queue settings, filled lazily
+        self._entry_ids = itertools.count()  # Source of SQS batch entry IDs
 
         # Monitoring metrics
         self.metrics = {
@@ -74,8 +105,23 @@ class BatchSQSBroker(SQSBroker):
             "oversized_message_dropped": defaultdict(int),
         }
 
-        self.lock = threading.Lock()  # Use threading lock to ensure thread safety
+        # Reentrant, so a batch can be sent inline by a thread holding the lock once the send pool is shut down
+        self.lock = threading.RLock()
+        # Flushed batches are sent from this pool, so callers never wait on SQS and batches overlap in flight
+        self._flush_executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_flushes, thread_name_prefix="BatchSQSBroker-Send"
+        )
+        self._pending_sends: dict[Future, tuple[str, list[dict]]] = {}  # Submitted batches not completed yet
+        self._pending_counts: dict[str, int] = defaultdict(int)  # Entries of _pending_sends by queue name
+        # Guards the two above on its own, so a completing batch never waits for the main lock
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Condition(self.lock)  # Wakes the background thread when deadlines change
+        self._flush_deadlines: list[tuple[float, str]] = []  # Heap of (earliest flush time, queue name)
+        self._scheduled_queues: set[str] = set()  # Queues with an entry in _flush_deadlines
+        self._next_retry_times: dict[str, float] = {}  # Earliest retry time of each queue's failed messages
         self._running = True
+        self._closed = False  # Set by close() and forceful_shutdown(), later messages are sent right away
+        self._forcefully_shut_down = False  # Set by forceful_shutdown(), later messages are rejected
         self._background_thread: Optional[threading.Thread] = None
         # Start background thread for checking tasks
         self._start_background_flush()
@@ -84,50 +130,157 @@ class BatchSQSBroker(SQSBroker):
         """
         Override enqueue to add messages to buffer and send based on group conditions.
         """
-        queue_name = message.queue_name
+        self._check_not_shut_down()
+        entry = self._build_entry(message, delay)
         with self.lock:
-            if queue_name not in self.buffer:
-                self.buffer[queue_name] = []
-                self.last_flush[queue_name] = time.time()
-                self.last_message_time[queue_name] = time.time()
+            self._check_capacity(message.queue_name, 1)
+            self._enqueue_locked(message.queue_name, [entry])
 
-            # Check buffer size limit (backpressure mechanism)
-            current_buffer_size = len(self.buffer[queue_name]) + len(self.failed_messages[queue_name])
-            if current_buffer_size >= self.max_buffer_size_per_queue:
-                self.metrics["buffer_overflow_count"][queue_name] += 1
-                self.logger.warning(
-                    f"Buffer overflow for queue {queue_name}: {current_buffer_size} messages. "
-                    f"Forcing flush to prevent memory issues."
-                )
-                # Force flush to free up space
-                self._flush(queue_name)
+        return message
 
-                # If still full after flush, reject new messages
-                if (
-                    len(self.buffer[queue_name]) + len(self.failed_messages[queue_name])
-                    >= self.max_buffer_size_per_queue
-                ):
-                    self.logger.error(f"Buffer still full after flush for queue {queue_name}, rejecting message")
-                    raise BufferError(f"Buffer full for queue {queue_name}, cannot accept new messages")
-
-            # Generate SQS message format using the same encoding as SQSBroker
-            encoded_message = b64encode(message.encode()).decode()
-            # Use UUID to avoid ID conflicts
-            message_id = str(uuid.uuid4())[:10]  # SQS ID limit is 80 chars, first 10 chars are sufficient
-            entry = {"Id": message_id, "MessageBody": encoded_message}
-            if delay is not None:
-                entry["DelaySeconds"] = min(int(delay / 1000), 900)
-            self.buffer[queue_name].append(entry)
-            self.last_message_time[queue_name] = time.time()  # Update last message time
-
-            # Get group's batch_interval
-            batch_interval = self.group_batch_intervals.get(queue_name, self.default_batch_interval)
-
-            # Check if should send immediately (full capacity or batch_interval=0)
-            if len(self.buffer[queue_name]) >= self.batch_size or batch_interval == 0:
-                self._flush(queue_name)
+    def enqueue_many(self, messages: list[Message], *, delay: int = None) -> list[Message]:
+        """
+        Add multiple messages to the buffer while acquiring the lock only once.
+        Messages are grouped by queue, and each queue is flushed or scheduled once for its whole group,
+        so queues with batch_interval=0 send the group as full batches instead of one message at a time.
+        Capacity is checked for every queue before buffering anything: if BufferError is raised,
+        none of the messages has been enqueued.
+        """
+        self._check_not_shut_down()
+        entries_by_queue: dict[str, list[dict]] = defaultdict(list)
+        for message in messages:
+            entries_by_queue[message.queue_name].append(self._build_entry(message, delay))
 
-        return message
+        with self.lock:
+            for queue_name, entries in entries_by_queue.items():
+                self._check_capacity(queue_name, len(entries))
+            for queue_name, entries in entries_by_queue.items():
+                self._enqueue_locked(queue_name, entries)
+
+        return messages
+
+    def _check_not_shut_down(self):
+        """
+        Reject new messages after forceful_shutdown(), which stopped the send pool without draining it.
+        """
+        if self._forcefully_shut_down:
+            raise RuntimeError("BatchSQSBroker was forcefully shut down, cannot accept new messages")
+
+    def _build_entry(self, message: Message, delay: int = None) -> dict:
+        """
+        Build the SQS entry for a message.
+        Done before taking the lock, since encoding is the most expensive part of enqueueing.
+        """
+        # Generate SQS message format using the same encoding as SQSBroker
+        encoded_message = b64encode(message.encode()).decode()
+        # IDs only need to be unique within a batch; a wrapping 32-bit counter keeps them short and cheap
+        message_id = f"{next(self._entry_ids) & 0xFFFFFFFF:x}"
+        entry = {"Id": message_id, "MessageBody": encoded_message}
+        if delay is not None:
+            entry["DelaySeconds"] = min(int(delay / 1000), 900)
+        return entry
+
+    def _check_capacity(self, queue_name: str, count: int):
+        """
+        Make sure a queue can take count more messages, raising BufferError otherwise (caller must hold the lock).
+        """
+        # Check buffer size limit (backpressure mechanism), counting batches still waiting to be sent
+        current_buffer_size = self._queued_count(queue_name)
+        if current_buffer_size + count > self.max_buffer_size_per_queue:
+            self.metrics["buffer_overflow_count"][queue_name] += 1
+            self.logger.warning(
+                f"Buffer overflow for queue {queue_name}: {current_buffer_size} messages. "
+                f"Forcing flush to prevent memory issues."
+            )
+            # Force flush to free up space
+            self._flush(queue_name)
+
+            # If still full after flush, reject new messages
+            if self._queued_count(queue_name) + count > self.max_buffer_size_per_queue:
+                self.logger.error(f"Buffer still full after flush for queue {queue_name}, rejecting message")
+                raise BufferError(f"Buffer full for queue {queue_name}, cannot accept new messages")
+
+    def _enqueue_locked(self, queue_name: str, entries: list[dict]):
+        """
+        Add entries to their queue buffer (caller must hold the lock and have checked capacity).
+        """
+        if queue_name not in self.buffer:
+            self.buffer[queue_name] = []
+            self.last_flush[queue_name] = time.time()
+            self.last_message_time[queue_name] = time.time()
+
+        config = self._get_queue_config(queue_name)
+
+        # Queues with batch_interval=0 send new messages right away without going through the buffer,
+        # unless it still holds earlier messages (e.g. retries), which must not be overtaken
+        if not self.buffer[queue_name] and config.batch_interval == 0:
+            self.last_message_time[queue_name] = self.last_flush[queue_name] = time.time()
+            self._submit_send(queue_name, entries)
+            return
+
+        self.buffer[queue_name].extend(entries)
+        self.last_message_time[queue_name] = time.time()  # Update last message time
+
+        # Check if should send immediately (full capacity, batch_interval=0, or no background thread left to flush)
+        if (
+            len(self.buffer[queue_name]) >= self.batch_size
+            or config.batch_interval == 0
+            or self._closed
+        ):
+            self._flush(queue_name)
+        else:
+            self._schedule_flush(queue_name)
+
+    def _queued_count(self, queue_name: str) -> int:
+        """
+        Get the number of messages of a queue held in memory: buffered, failed or handed to the send pool.
+        """
+        return (
+            len(self.buffer.get(queue_name, ()))
+            + len(self.failed_messages[queue_name])
+            + self._pending_counts[queue_name]
+        )
+
+    def _get_queue_config(self, queue_name: str) -> QueueConfig:
+        """
+        Get the batching settings for a queue, resolving group overrides and defaults once per queue.
+        """
+        config = self._queue_configs.get(queue_name)
+        if config is None:
+            config = self._resolve_queue_config(queue_name)
+            self._queue_configs[queue_name] = config
+        return config
+
+    def _resolve_queue_config(self, queue_name: str) -> QueueConfig:
+        """
+        Build the batching settings for a queue from its group overrides and the defaults.
+        """
+        return QueueConfig(
+            batch_interval=self.group_batch_intervals.get(queue_name, self.default_batch_interval),
+            idle_timeout=self.group_idle_timeouts.get(queue_name, self.default_idle_timeout),
+        )
+
+    def _next_flush_time(self, queue_name: str) -> float:
+        """
+        Get the time at which a queue's buffer is due, by batch_interval or idle_timeout, whichever comes first.
+        """
+        config = self._get_queue_config(queue_name)
+        return min(
+            self.last_flush.get(queue_name, 0.0) + config.batch_interval,
+            self.last_message_time.get(queue_name, 0.0) + config.idle_timeout,
+        )
+
+    def _schedule_flush(self, queue_name: str):
+        """
+        Register a queue with the background thread (caller must hold the lock).
+        Each queue has at most one heap entry; since flush times only move forward, an entry is never late,
+        and the background thread re-checks the actual flush time when the entry comes due.
+        """
+        if queue_name in self._scheduled_queues:
+            return
+        self._scheduled_queues.add(queue_name)
+        heapq.heappush(self._flush_deadlines, (self._next_flush_time(queue_name), queue_name))
+        self._wakeup.notify()
 
     def _flush(self, queue_name: str):
         """
@@ -140,22 +293,55 @@ class BatchSQSBroker(SQSBroker):
         if not self.buffer.get(queue_name):
             return
 
-        # Copy data within lock, then release lock
-        entries_to_send = self.buffer[queue_name].copy()
-        self.buffer[queue_name] = []  # Clear buffer immediately
+        # Take the buffered list within lock and start a new one, instead of copying and clearing it
+        entries_to_send = self.buffer[queue_name]
+        self.buffer[queue_name] = []
         self.last_flush[queue_name] = time.time()
 
-        # Release lock before SQS API calls
+        # Hand SQS API calls to the send pool, which runs them outside the lock
         # This allows other threads to continue adding messages to buffer
-        self._send_to_sqs(queue_name, entries_to_send)
+        self._submit_send(queue_name, entries_to_send)
+
+    def _submit_send(self, queue_name: str, entries: list[dict]):
+        """
+        Queue entries for sending by the send pool (caller must hold the lock).
+        Once the pool is shut down, by close() or at interpreter exit (Python 3.9+ stops executors
+        before atexit hooks run), the entries are sent inline instead.
+        """
+        try:
+            future = self._flush_executor.submit(self._send_to_sqs, queue_name, entries)
+        except RuntimeError:
+            self._send_to_sqs(queue_name, entries)
+            return
+        with self._pending_lock:
+            self._pending_sends[future] = (queue_name, entries)
+            self._pending_counts[queue_name] += len(entries)
+        future.add_done_callback(self._send_done)
+
+    def _send_done(self, future: Future):
+        """
+        Forget a batch of the send pool once it has been sent or cancelled.
+        """
+        with self._pending_lock:
+            queue_name, entries = self._pending_sends.pop(future)
+            self._pending_counts[queue_name] -= len(entries)
+
+    def _message_size(self, entry: dict) -> int:
+        """
+        Get the UTF-8 size in bytes of a message body.
+        Bodies built by enqueue are base64 (ASCII), so their length is their size and no copy is needed.
+        """
+        body = entry["MessageBody"]
+        if body.isascii():
+            return len(body)
+        return len(body.encode("utf-8"))
 
     def _check_message_size(self, entry: dict) -> bool:
         """
         Check if a single message exceeds SQS limits.
         SQS single message maximum is 256KB.
         """
-        message_size = len(entry["MessageBody"].encode("utf-8"))
-        return message_size <= 256 * 1024
+        return self._message_size(entry) <= 256 * 1024
 
     def _split_oversized_batch(self, entries: list[dict], queue_name: str) -> tuple[list[list[dict]], list[dict]]:
         """
@@ -168,24 +354,18 @@ class BatchSQSBroker(SQSBroker):
         sendable_batches = []
         oversized_messages = []
 
-        # First filter out truly oversized single messages
-        valid_entries = []
-        for entry in entries:
-            if not self._check_message_size(entry):
-                oversized_messages.append(entry)
-                self.logger.error(f"Single message {entry['Id']} exceeds 256KB limit for queue {queue_name}, dropping")
-            else:
-                valid_entries.append(entry)
-
-        if not valid_entries:
-            return [], oversized_messages
-
-        # Use greedy algorithm to organize batches
+        # Single greedy pass: drop oversized messages and pack the rest, measuring each message once
         current_batch = []
         current_size = 0
 
-        for entry in valid_entries:
-            entry_size = len(entry["MessageBody"].encode("utf-8"))
+        for entry in entries:
+            entry_size = self._message_size(entry)
+
+            # Filter out truly oversized single messages
+            if entry_size > MAX_BATCH_SIZE_BYTES:
+                oversized_messages.append(entry)
+                self.logger.error(f"Single message {entry['Id']} exceeds 256KB limit for queue {queue_name}, dropping")
+                continue
 
             # Check if can add to current batch
             if len(current_batch) < MAX_MESSAGES_PER_BATCH and current_size + entry_size <= MAX_BATCH_SIZE_BYTES:
@@ -193,8 +373,7 @@ class BatchSQSBroker(SQSBroker):
                 current_size += entry_size
             else:
                 # Current batch is full, start new batch
-                if current_batch:
-                    sendable_batches.append(current_batch)
+                sendable_batches.append(current_batch)
                 current_batch = [entry]
                 current_size = entry_size
 
@@ -203,7 +382,9 @@ class BatchSQSBroker(SQSBroker):
             sendable_batches.append(current_batch)
 
         if len(sendable_batches) > 1:
-            self.metrics["batch_split_count"][queue_name] += 1
+            # Batches of the same queue may be split concurrently
+            with self.lock:
+                self.metrics["batch_split_count"][queue_name] += 1
             self.logger.info(
                 f"Split oversized batch for queue {queue_name}: "
                 f"{len(entries)} messages → {len(sendable_batches)} batches"
@@ -213,21 +394,26 @@ class BatchSQSBroker(SQSBroker):
 
     def _send_to_sqs(self, queue_name: str, entries: list[dict]):
         """
-        Actually send messages to SQS (no need to hold lock).
+        Actually send messages to SQS (normally runs in the send pool, without holding the lock).
         Optimization: Intelligently handle oversized batches to avoid infinite retry loops.
         """
         if not entries:
             return
 
         # Ensure queue exists in self.queues
-        if queue_name not in self.queues:
-            prefixed_queue_name = f"{self.namespace}{queue_name}"
-            self.queues[queue_name] = self.sqs.get_queue_by_name(QueueName=prefixed_queue_name)
+        try:
+            if queue_name not in self.queues:
+                prefixed_queue_name = f"{self.namespace}{queue_name}"
+                self.queues[queue_name] = self.sqs.get_queue_by_name(QueueName=prefixed_queue_name)
+        except Exception as e:
+            self.logger.error(f"Error looking up queue {queue_name}: {e}", exc_info=True)
+            self._record_failed_entries(queue_name, entries)
+            return
 
         queue = self.queues[queue_name]
 
         # First check if batch splitting is needed
-        total_size = sum(len(entry["MessageBody"].encode("utf-8")) for entry in entries)
+        total_size = sum(self._message_size(entry) for entry in entries)
         if total_size > 256 * 1024:
             # Use intelligent splitting to handle oversized batches
             sendable_batches, oversized_messages = self._split_oversized_batch(entries, queue_name)
@@ -261,9 +447,6 @@ class BatchSQSBroker(SQSBroker):
         try:
             response = queue.send_messages(Entries=batch_entries)
 
-            # Record success count
-            success_count = len(batch_entries)
-
             # Check if there are failed messages
             if "Failed" in response and response["Failed"]:
                 failed = response["Failed"]
@@ -271,48 +454,68 @@ class BatchSQSBroker(SQSBroker):
 
                 # Add failed messages to retry queue
                 failed_ids = {f["Id"] for f in failed}
-                with self.lock:
-                    for entry in batch_entries:
-                        if entry["Id"] in failed_ids:
-                            self.failed_messages[queue_name].append(FailedMessage(entry=entry))
-                            success_count -= 1
-
-                self.metrics["messages_failed"][queue_name] += len(failed)
+                failed_entries = [entry for entry in batch_entries if entry["Id"] in failed_ids]
+                self._record_failed_entries(queue_name, failed_entries)
+                success_count = len(batch_entries) - len(failed_entries)
+            else:
+                success_count = len(batch_entries)
 
-            self.metrics["messages_sent"][queue_name] += success_count
+            # Batches of the same queue may complete concurrently
+            with self.lock:
+                self.metrics["messages_sent"][queue_name] += success_count
 
         except Exception as e:
             self.logger.error(f"Error sending batch to {queue_name}: {e}", exc_info=True)
             # Add all messages to failed queue
-            with self.lock:
-                for entry in batch_entries:
-                    self.failed_messages[queue_name].append(FailedMessage(entry=entry))
-                self.metrics["messages_failed"][queue_name] += len(batch_entries)
+            self._record_failed_entries(queue_name, batch_entries)
+
+    def _record_failed_entries(self, queue_name: str, entries: list[dict]):
+        """
+        Add entries that could not be sent to the retry queue.
+        """
+        with self.lock:
+            for entry in entries:
+                self.failed_messages[queue_name].append(FailedMessage(entry=entry))
+            self.metrics["messages_failed"][queue_name] += len(entries)
+            self._next_retry_times.pop(queue_name, None)  # New failures may be due sooner, rescan the queue
+            self._wakeup.notify()  # Let the background thread schedule the retry
 
-    def _retry_failed_messages(self, queue_name: str):
+    def _retry_failed_messages(self, queue_name: str) -> Optional[float]:
         """
         Retry failed messages with retry count limits.
+        Returns the time at which the next remaining failed message can be retried, or None if none remain.
         """
         if queue_name not in self.failed_messages or not self.failed_messages[queue_name]:
-            return
+            return None
 
         current_time = time.time()
         messages_to_retry = []
         messages_to_drop = []
+        messages_to_keep = []
+        next_retry_time = None
 
+        # Partition in a single pass instead of removing messages one by one,
+        # which would rescan (and compare entries of) the whole list for each removal
         for failed_msg in self.failed_messages[queue_name]:
             # Check retry count
             if failed_msg.retry_count >= self.max_retry_attempts:
                 messages_to_drop.append(failed_msg)
+            # Use exponential backoff: 2^retry_count seconds
+            elif current_time - failed_msg.last_failure_time >= 2**failed_msg.retry_count:
+                messages_to_retry.append(failed_msg)
             else:
-                # Use exponential backoff: 2^retry_count seconds
-                retry_delay = 2**failed_msg.retry_count
-                if current_time - failed_msg.last_failure_time >= retry_delay:
-                    messages_to_retry.append(failed_msg)
+                messages_to_keep.append(failed_msg)
+                retry_time = failed_msg.last_failure_time + 2**failed_msg.retry_count
+                if next_retry_time is None or retry_time < next_retry_time:
+                    next_retry_time = retry_time
+
+        if not messages_to_retry and not messages_to_drop:
+            return next_retry_time
+
+        self.failed_messages[queue_name] = messages_to_keep
 
         # Handle messages that exceeded retry count
         for msg in messages_to_drop:
-            self.failed_messages[queue_name].remove(msg)
             self.metrics["retry_exhausted_count"][queue_name] += 1
             self.logger.error(
                 f"Message {msg.entry['Id']} for queue {queue_name} dropped after "
@@ -326,37 +529,69 @@ class BatchSQSBroker(SQSBroker):
                 msg.retry_count += 1
                 msg.last_failure_time = current_time
                 self.buffer[queue_name].append(msg.entry)
-                self.failed_messages[queue_name].remove(msg)
 
             self.logger.info(f"Retrying {len(messages_to_retry)} messages for queue {queue_name}")
 
+        return next_retry_time
+
+    def _flush_due_queues(self) -> Optional[float]:
+        """
+        Retry due failed messages and flush queues whose deadline has passed (caller must hold the lock).
+        Returns the number of seconds until the next deadline, or None if nothing is pending.
+        """
+        current_time = time.time()
+        next_wakeup = None
+
+        # Move failed messages whose backoff has elapsed back into their buffers,
+        # only scanning queues whose earliest retry time has been reached
+        for queue_name, failed in list(self.failed_messages.items()):
+            if not failed:
+                continue
+            next_retry = self._next_retry_times.get(queue_name, 0.0)
+            if next_retry <= current_time:
+                next_retry = self._retry_failed_messages(queue_name)
+                if self.buffer.get(queue_name):
+                    self._schedule_flush(queue_name)
+                if next_retry is None:
+                    self._next_retry_times.pop(queue_name, None)
+                    continue
+                self._next_retry_times[queue_name] = next_retry
+            next_wakeup = next_retry if next_wakeup is None else min(next_wakeup, next_retry)
+
+        # Flush queues whose deadline has passed, rescheduling those that received messages since
+        while self._flush_deadlines and self._flush_deadlines[0][0] <= current_time:
+            _, queue_name = heapq.heappop(self._flush_deadlines)
+            self._scheduled_queues.discard(queue_name)
+            if not self.buffer.get(queue_name):
+                continue
+            if self._next_flush_time(queue_name) <= current_time:
+                self._flush(queue_name)
+            else:
+                self._schedule_flush(queue_name)
+
+        if self._flush_deadlines:
+            next_flush = self._flush_deadlines[0][0]
+            next_wakeup = next_flush if next_wakeup is None else min(next_wakeup, next_flush)
+
+        if next_wakeup is None:
+            return None
+        return max(next_wakeup - time.time(), 0.0)
+
     def _start_background_flush(self):
         """
-        Start background thread to periodically check and flush buffers.
+        Start background thread to flush buffers when their batch_interval or idle_timeout expires.
+        The thread sleeps until the earliest pending deadline instead of polling, and is woken up
+        whenever a queue is scheduled, a message fails or the broker is closed.
         Enhancement: Added exception handling and automatic restart.
         """
 
         def check_idle_buffers():
             while self._running:
                 try:
-                    time.sleep(0.05)  # Check every 50ms
-                    with self.lock:
-                        current_time = time.time()
-                        for queue_name in list(self.buffer.keys()):
-                            # Get group's batch_interval and idle_timeout
-                            batch_interval = self.group_batch_intervals.get(queue_name, self.default_batch_interval)
-                            idle_timeout = self.group_idle_timeouts.get(queue_name, self.default_idle_timeout)
-
-                            # Check if timeout (batch_interval) or idle (idle_timeout)
-                            if self.buffer[queue_name] and (
-                                current_time - self.last_flush[queue_name] >= batch_interval
-                                or current_time - self.last_message_time[queue_name] >= idle_timeout
-                            ):
-                                self._flush(queue_name)
-
-                            # Also check if failed messages need retry
-                            if self.failed_messages[queue_name]:
-                                self._retry_failed_messages(queue_name)
+                    with self._wakeup:
+                        timeout = self._flush_due_queues()
+                        if self._running:
+                            self._wakeup.wait(timeout)
 
                 except Exception as e:
                     self.logger.error(f"Error in background flush thread: {e}", exc_info=True)
@@ -381,8 +616,11 @@ class BatchSQSBroker(SQSBroker):
 
     def flush_all(self):
         """
-        Send buffered messages from all queues.
+        Send buffered messages from all queues (does nothing after forceful_shutdown()).
         """
+        if self._forcefully_shut_down:
+            return
+
         with self.lock:
             queue_names = list(self.buffer.keys())
 
@@ -412,11 +650,21 @@ class BatchSQSBroker(SQSBroker):
                 "background_thread_alive": self._background_thread.is_alive() if self._background_thread else False,
             }
 
+    def is_healthy(self) -> bool:
+        """
+        Check that the broker is running and its background thread is alive.
+        Cheap enough for frequent health checks: takes no lock and does not look at any queue.
+        """
+        thread = self._background_thread
+        return self._running and thread is not None and thread.is_alive()
+
     def get_queue_status(self, queue_name: str) -> dict:
         """
         Get detailed status information for a specific queue.
         """
         with self.lock:
+            # Queue names may come from user input (e.g. a URL), so only queues in use are cached
+            config = self._queue_configs.get(queue_name) or self._resolve_queue_config(queue_name)
             return {
                 "queue_name": queue_name,
                 "buffer_size": len(self.buffer.get(queue_name, [])),
@@ -429,8 +677,8 @@ class BatchSQSBroker(SQSBroker):
                 "oversized_message_dropped": self.metrics["oversized_message_dropped"][queue_name],
                 "last_flush_time": self.last_flush.get(queue_name),
                 "last_message_time": self.last_message_time.get(queue_name),
-                "batch_interval": self.group_batch_intervals.get(queue_name, self.default_batch_interval),
-                "idle_timeout": self.group_idle_timeouts.get(queue_name, self.default_idle_timeout),
+                "batch_interval": config.batch_interval,
+                "idle_timeout": config.idle_timeout,
             }
 
     def clear_queue_buffer(self, queue_name: str) -> int:
@@ -466,9 +714,15 @@ class BatchSQSBroker(SQSBroker):
         """
         Close broker and clean up resources.
         Enhancement: Gracefully shut down background thread.
-        """
+        Calling it again is a no-op; messages enqueued after closing are sent right away.
+        """
+        with self._wakeup:
+            if self._closed:
+                return
+            self._closed = True
+            self._running = False
+            self._wakeup.notify_all()
         self.logger.info("Closing BatchSQSBroker...")
-        self._running = False
 
         # Wait for background thread to finish
         if self._background_thread and self._background_thread.is_alive():
@@ -476,11 +730,70 @@ class BatchSQSBroker(SQSBroker):
             if self._background_thread.is_alive():
                 self.logger.warning("Background thread did not stop gracefully")
 
-        # Final flush of all buffers
+        # Wait for batches already handed to the send pool, then send the remaining buffers from this thread
+        self._flush_executor.shutdown(wait=True)
         self.flush_all()
 
         # Log final status
         final_metrics = self.get_metrics()
         self.logger.info(f"BatchSQSBroker closed. Final metrics: {final_metrics}")
 
-        super().close()
\ No newline at end of file
+        super().close()
+
+    def forceful_shutdown(self, timeout: float = 0.5, dump_path: Optional[str] = None) -> Optional[str]:
+        """
+        Stop the broker immediately without sending anything, for when a graceful close() hangs.
+        Buffered messages, failed messages and batches still waiting for the send pool are written
+        to a JSON lines file ({"queue_name": ..., "entry": ...} per line) so they can be replayed.
+
+        :param timeout: Maximum time to wait for the lock, the messages are collected without it afterwards.
+        :param dump_path: Dump file path (default: a new batch_sqs_broker_dump_<pid>_*.jsonl in the temp directory).
+        :return: The dump file path, or None if no message was left.
+
+        Afterwards the broker rejects new messages and close() and flush_all() do nothing,
+        so the dumped messages are never sent as well.
+        """
+        self.logger.warning("Forcefully shutting down BatchSQSBroker...")
+        self._forcefully_shut_down = True
+        self._closed = True  # The dumped messages must not be sent by a later close()
+        self._running = False
+
+        # The lock may be held by a hung flush; it is reentrant, so a thread that already holds it
+        # (e.g. a signal handler interrupting an enqueue) gets it right away
+        locked = self.lock.acquire(timeout=timeout)
+        try:
+            if locked:
+                self._wakeup.notify_all()
+
+            unsent = []
+            for future, (queue_name, entries) in list(self._pending_sends.items()):
+                # Only batches that have not started sending can be cancelled
+                if future.cancel():
+                    unsent.extend((queue_name, entry) for entry in entries)
+            for queue_name, entries in list(self.buffer.items()):
+                unsent.extend((queue_name, entry) for entry in entries)
+            for queue_name, failed in list(self.failed_messages.items()):
+                unsent.extend((queue_name, msg.entry) for msg in failed)
+            self.buffer.clear()
+            self.failed_messages.clear()
+        finally:
+            if locked:
+                self.lock.release()
+
+        self._flush_executor.shutdown(wait=False)
+
+        if not unsent:
+            return None
+
+        if dump_path is None:
+            # A new file with a random name, so a planted file or symlink in the shared temp directory is never written
+            fd, dump_path = tempfile.mkstemp(prefix=f"batch_sqs_broker_dump_{os.getpid()}_", suffix=".jsonl")
+            f = os.fdopen(fd, "w")
+        else:
+            f = open(dump_path, "w")
+        with f:
+            for queue_name, entry in unsent:
+                f.write(json.dumps({"queue_name": queue_name, "entry": entry}) + "\n")
+
+        self.logger.warning(f"Dumped {len(unsent)} unsent messages to {dump_path}")
+        return dump_path
\ No newline at end of file
@@ -0,0 +1,79 @@
+"""
+Gunicorn configuration for the Flask integration example.
+
+Usage:
+    gunicorn -c flask_gunicorn_conf.py flask_integration:app
+
+Each worker process owns exactly one BatchSQSBroker (created when the worker
+imports flask_integration) together with its background flush thread.
+Worker threads share that broker, so concurrent requests keep filling the
+same batches instead of each process sending half-empty ones.
+"""
+
+import multiprocessing
+import sys
+
+# Worker configuration
+workers = multiprocessing.cpu_count() * 2 + 1
+worker_class = "gthread"  # Threaded workers let several requests enqueue concurrently
+threads = 8  # Requests keep being served while another thread waits on the broker lock
+bind = "0.0.0.0:5000"
+
+# Alternatively, use gevent workers:
+#
+#   worker_class = "gevent"
+#   worker_connections = 1000
+#
+# Gunicorn's gevent worker monkey-patches the standard library when the worker
+# starts, before the app is loaded. As long as preload_app stays False, boto3 is
+# imported after patching, so the broker's SQS calls and its flush thread become
+# cooperative. Do not import boto3 (or the app) from this config file.
+
+# Do NOT preload the app: threads do not survive fork(), so a broker created
+# in the master would reach the workers without its background flush thread.
+# Loading the app after fork gives every worker its own broker and thread.
+preload_app = False
+
+# Timeout settings
+graceful_timeout = 30  # Time for graceful shutdown
+timeout = 60
+keepalive = 5
+
+# Logging
+accesslog = "-"
+errorlog = "-"
+loglevel = "info"
+
+
+# CRITICAL: Worker lifecycle hooks for proper shutdown
+def worker_int(worker):
+    """Called when worker receives SIGINT or SIGQUIT."""
+    print(f"Worker {worker.pid} received interrupt signal")
+
+
+def worker_abort(worker):
+    """Called when worker receives SIGABRT (e.g. after a timeout)."""
+    print(f"Worker {worker.pid} received abort signal")
+
+
+def worker_exit(server, worker):
+    """
+    Called in the worker process just after it exits.
+    Runs for graceful (SIGTERM), interrupted and aborted exits alike, so it is
+    the single place where the worker's broker gets flushed.
+    """
+    _cleanup_broker()
+
+
+def _cleanup_broker():
+    """Ensure broker is properly closed."""
+    import dramatiq
+
+    try:
+        broker = dramatiq.get_broker()
+        if hasattr(broker, "close"):
+            print("Closing BatchSQSBroker to flush buffers...")
+            broker.close()
+            print("BatchSQSBroker closed successfully")
+    except Exception as e:
+        print(f"Error closing broker: {e}", file=sys.stderr)
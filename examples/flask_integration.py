@@ -9,15 +9,30 @@ This example demonstrates:
 """
 
 import os
-import sys
 import atexit
 import signal
+import threading
 from typing import Dict, Any
 
 import dramatiq
+from dramatiq.errors import DecodeError
 from flask import Flask, jsonify, request
+from flask.json.provider import JSONProvider
 from batch_sqs_broker import BatchSQSBroker
 
+try:
+    import orjson  # Optional: faster message encoding
+except ImportError:
+    orjson = None
+
+# Enable logging
+import logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Enable batch_sqs_broker logging
+logging.getLogger('batch_sqs_broker').setLevel(logging.INFO)
+
 # -----------------------------------------------------------------------------
 # Broker Setup
 # -----------------------------------------------------------------------------
@@ -45,6 +60,34 @@ broker = BatchSQSBroker(
 # Set as default broker
 dramatiq.set_broker(broker)
 
+
+# -----------------------------------------------------------------------------
+# Message Encoding
+# -----------------------------------------------------------------------------
+
+class ORJSONEncoder(dramatiq.Encoder):
+    """
+    Encode messages with orjson instead of the standard json module.
+
+    Every .send() encodes its message, so this is the main CPU cost of enqueueing.
+    The output is plain JSON: workers using dramatiq's default JSONEncoder can
+    still decode these messages, and vice versa.
+    """
+
+    def encode(self, data):
+        # OPT_NON_STR_KEYS converts non-string keys like json.dumps does
+        return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, data):
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError as e:
+            raise DecodeError("failed to decode message %r" % (data,), data, e) from None
+
+
+if orjson is not None:
+    dramatiq.set_encoder(ORJSONEncoder())
+
 # -----------------------------------------------------------------------------
 # Dramatiq Tasks
 # -----------------------------------------------------------------------------
@@ -52,9 +95,9 @@ dramatiq.set_broker(broker)
 @dramatiq.actor(queue_name="urgent")
 def send_email(to_address: str, subject: str, body: str):
     """Send urgent email notification."""
-    print(f"[URGENT] Sending email to {to_address}")
-    print(f"  Subject: {subject}")
-    print(f"  Body: {body[:100]}...")
+    # Use %-style arguments so messages are only formatted when the log level is enabled
+    logger.info("Sending email to %s", to_address)
+    logger.debug("Email subject: %s, body: %.100s", subject, body)
     # Implement actual email sending logic here
     return f"Email sent to {to_address}"
 
@@ -62,8 +105,8 @@ def send_email(to_address: str, subject: str, body: str):
 @dramatiq.actor(queue_name="default")
 def process_order(order_id: str, customer_id: str, items: list):
     """Process customer order."""
-    print(f"Processing order {order_id} for customer {customer_id}")
-    print(f"  Items: {items}")
+    logger.info("Processing order %s for customer %s", order_id, customer_id)
+    logger.debug("Order %s items: %s", order_id, items)
     # Implement order processing logic here
     return f"Order {order_id} processed"
 
@@ -71,7 +114,7 @@ def process_order(order_id: str, customer_id: str, items: list):
 @dramatiq.actor(queue_name="background")
 def cleanup_old_data(days_old: int):
     """Background task to cleanup old data."""
-    print(f"[BACKGROUND] Cleaning up data older than {days_old} days")
+    logger.info("Cleaning up data older than %s days", days_old)
     # Implement cleanup logic here
     return f"Cleaned up data older than {days_old} days"
 
@@ -79,8 +122,8 @@ def cleanup_old_data(days_old: int):
 @dramatiq.actor(queue_name="background")
 def generate_report(report_type: str, params: dict):
     """Generate report in background."""
-    print(f"[BACKGROUND] Generating {report_type} report")
-    print(f"  Parameters: {params}")
+    logger.info("Generating %s report", report_type)
+    logger.debug("Report %s parameters: %s", report_type, params)
     # Implement report generation logic here
     return f"{report_type} report generated"
 
@@ -89,16 +132,33 @@ def generate_report(report_type: str, params: dict):
 # Flask Application
 # -----------------------------------------------------------------------------
 
-app = Flask(__name__)
-app.config['JSON_SORT_KEYS'] = False
+class ORJSONProvider(JSONProvider):
+    """
+    Serialize JSON with orjson for jsonify() and request.get_json().
 
-# Enable logging
-import logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
+    Enqueue endpoints do little besides building their response, so its
+    serialization is a noticeable part of each request. Keys are not sorted.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Use orjson's bytes directly instead of decoding them to str and encoding them again
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS), mimetype="application/json"
+        )
 
-# Enable batch_sqs_broker logging
-logging.getLogger('batch_sqs_broker').setLevel(logging.INFO)
+
+app = Flask(__name__)
+if orjson is not None:
+    app.json = ORJSONProvider(app)
+else:
+    app.json.sort_keys = False
 
 
 # -----------------------------------------------------------------------------
@@ -115,14 +175,14 @@ def cleanup_broker():
     try:
         # Get final metrics
         metrics = broker.get_metrics()
-        logger.info(f"Final broker metrics: {metrics}")
+        logger.info("Final broker metrics: %s", metrics)
         
         # Close the broker to flush all buffers
         broker.close()
         logger.info("BatchSQSBroker closed successfully - all buffers flushed")
         
     except Exception as e:
-        logger.error(f"Error during broker shutdown: {e}")
+        logger.error("Error during broker shutdown: %s", e)
         import traceback
         traceback.print_exc()
 
@@ -131,16 +191,39 @@ def cleanup_broker():
 atexit.register(cleanup_broker)
 
 
-# Also handle SIGTERM and SIGINT for container environments
-def signal_handler(signum, frame):
-    """Handle shutdown signals gracefully."""
-    logger.info(f"Received signal {signum}")
-    cleanup_broker()
-    sys.exit(0)
+# Also handle SIGTERM and SIGINT for container environments (development server only).
+# Under Gunicorn, the worker hooks in flask_gunicorn_conf.py handle shutdown instead:
+# installing handlers at import time would replace Gunicorn's own worker signal handling.
+_shutdown_requested = threading.Event()
 
 
-signal.signal(signal.SIGTERM, signal_handler)
-signal.signal(signal.SIGINT, signal_handler)
+def signal_handler(signum, frame):
+    """
+    Request a graceful shutdown on the first signal, force it on the second one.
+
+    The broker is NOT closed here: the handler runs on the main thread between two
+    bytecodes, possibly while that thread holds the broker lock, so closing the
+    broker from here could deadlock.
+    """
+    if not _shutdown_requested.is_set():
+        _shutdown_requested.set()
+        return
+
+    # Second signal: the graceful shutdown is taking too long. Restore the default
+    # handlers first, so a third signal kills the process even if this one hangs.
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    # Unsent messages are written to a dump file for later replay
+    broker.forceful_shutdown()
+    os._exit(1)
+
+
+def shutdown_watcher():
+    """Close the broker from a regular thread once a shutdown signal was received."""
+    _shutdown_requested.wait()
+    cleanup_broker()
+    # The broker is flushed, stop the development server
+    os._exit(0)
 
 
 # -----------------------------------------------------------------------------
@@ -180,7 +263,7 @@ def send_email_endpoint():
         }), 202
         
     except Exception as e:
-        logger.error(f"Error queueing email: {e}")
+        logger.error("Error queueing email: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -206,7 +289,62 @@ def process_order_endpoint():
         }), 202
         
     except Exception as e:
-        logger.error(f"Error queueing order: {e}")
+        logger.error("Error queueing order: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/email/bulk', methods=['POST'])
+def send_email_bulk_endpoint():
+    """Send a list of urgent emails in a single enqueue call."""
+    data = request.get_json()
+
+    if not isinstance(data, list) or not all(
+        isinstance(e, dict) and all(k in e for k in ['to', 'subject', 'body']) for e in data
+    ):
+        return jsonify({"error": "Expected a list of objects with fields: to, subject, body"}), 400
+
+    try:
+        # Build all messages first, then buffer them under a single broker lock
+        messages = broker.enqueue_many([
+            send_email.message(to_address=e['to'], subject=e['subject'], body=e['body'])
+            for e in data
+        ])
+
+        return jsonify({
+            "status": "queued",
+            "message_ids": [m.message_id for m in messages],
+            "queue": "urgent"
+        }), 202
+
+    except Exception as e:
+        logger.error("Error queueing emails: %s", e)
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/order/bulk', methods=['POST'])
+def process_order_bulk_endpoint():
+    """Process a list of customer orders in a single enqueue call."""
+    data = request.get_json()
+
+    if not isinstance(data, list) or not all(
+        isinstance(o, dict) and all(k in o for k in ['order_id', 'customer_id', 'items']) for o in data
+    ):
+        return jsonify({"error": "Expected a list of orders with fields: order_id, customer_id, items"}), 400
+
+    try:
+        messages = broker.enqueue_many([
+            process_order.message(order_id=o['order_id'], customer_id=o['customer_id'], items=o['items'])
+            for o in data
+        ])
+
+        return jsonify({
+            "status": "queued",
+            "message_ids": [m.message_id for m in messages],
+            "queue": "default"
+        }), 202
+
+    except Exception as e:
+        logger.error("Error queueing orders: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -226,7 +364,7 @@ def cleanup_data_endpoint():
         }), 202
         
     except Exception as e:
-        logger.error(f"Error queueing cleanup: {e}")
+        logger.error("Error queueing cleanup: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -251,7 +389,7 @@ def generate_report_endpoint():
         }), 202
         
     except Exception as e:
-        logger.error(f"Error queueing report: {e}")
+        logger.error("Error queueing report: %s", e)
         return jsonify({"error": str(e)}), 500
 
 
@@ -277,16 +415,10 @@ def flush_queue(queue_name: str):
 
 @app.route('/health')
 def health_check():
-    """Health check endpoint."""
-    try:
-        metrics = broker.get_metrics()
-        return jsonify({
-            "status": "healthy",
-            "broker_running": broker._running,
-            "background_thread_alive": metrics.get("background_thread_alive", False)
-        })
-    except Exception as e:
-        return jsonify({"status": "unhealthy", "error": str(e)}), 503
+    """Health check endpoint (polled often, so avoid building the full metrics)."""
+    if broker.is_healthy():
+        return jsonify({"status": "healthy"})
+    return jsonify({"status": "unhealthy"}), 503
 
 
 # -----------------------------------------------------------------------------
@@ -300,65 +432,10 @@ def not_found(error):
 
 @app.errorhandler(500)
 def internal_error(error):
-    logger.error(f"Internal error: {error}")
+    logger.error("Internal error: %s", error)
     return jsonify({"error": "Internal server error"}), 500
 
 
-# -----------------------------------------------------------------------------
-# Gunicorn Configuration (save as gunicorn_conf.py)
-# -----------------------------------------------------------------------------
-
-GUNICORN_CONFIG = """
-import multiprocessing
-import sys
-
-# Worker configuration
-workers = multiprocessing.cpu_count() * 2 + 1
-worker_class = "sync"  # Use 'gevent' for async if needed
-bind = "0.0.0.0:5000"
-
-# Timeout settings
-graceful_timeout = 30  # Time for graceful shutdown
-timeout = 60
-keepalive = 5
-
-# Logging
-accesslog = "-"
-errorlog = "-"
-loglevel = "info"
-
-# CRITICAL: Worker lifecycle hooks for proper shutdown
-def worker_int(worker):
-    \"\"\"Called when worker receives SIGINT or SIGQUIT.\"\"\"
-    print(f"Worker {worker.pid} received interrupt signal")
-    _cleanup_broker()
-
-
-def worker_abort(worker):
-    \"\"\"Called when worker receives SIGABRT.\"\"\"
-    print(f"Worker {worker.pid} received abort signal")
-    _cleanup_broker()
-
-
-def on_exit(server):
-    \"\"\"Called just before master process exits.\"\"\"
-    print("Master process exiting")
-    _cleanup_broker()
-
-
-def _cleanup_broker():
-    \"\"\"Ensure broker is properly closed.\"\"\"
-    import dramatiq
-    try:
-        broker = dramatiq.get_broker()
-        if hasattr(broker, 'close'):
-            print("Closing BatchSQSBroker to flush buffers...")
-            broker.close()
-            print("BatchSQSBroker closed successfully")
-    except Exception as e:
-        print(f"Error closing broker: {e}", file=sys.stderr)
-"""
-
 # -----------------------------------------------------------------------------
 # Running the Application
 # -----------------------------------------------------------------------------
@@ -368,14 +445,13 @@ if __name__ == "__main__":
     print("Flask with BatchSQSBroker Integration Example")
     print("="*60)
     print("\nTo run this application:")
-    print("\n1. Development mode (with debug):")
+    print("\n1. Development mode:")
     print("   python flask_integration.py")
     print("\n2. Production mode with Gunicorn:")
-    print("   Save the GUNICORN_CONFIG content to 'gunicorn_conf.py'")
-    print("   gunicorn -c gunicorn_conf.py flask_integration:app")
+    print("   gunicorn -c flask_gunicorn_conf.py flask_integration:app")
     print("\n3. Docker container:")
     print("   Ensure your Dockerfile uses proper signal handling:")
-    print("   CMD [\"gunicorn\", \"-c\", \"gunicorn_conf.py\", \"flask_integration:app\"]")
+    print("   CMD [\"gunicorn\", \"-c\", \"flask_gunicorn_conf.py\", \"flask_integration:app\"]")
     print("\n4. Test endpoints:")
     print("   curl http://localhost:5000/")
     print("   curl -X POST http://localhost:5000/email -H 'Content-Type: application/json' \\")
@@ -383,5 +459,11 @@ if __name__ == "__main__":
     print("\nIMPORTANT: Always ensure proper shutdown handling to prevent message loss!")
     print("="*60 + "\n")
     
-    # Run Flask development server
-    app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+    threading.Thread(target=shutdown_watcher, daemon=True, name="shutdown-watcher").start()
+
+    # Run Flask development server (development only, use Gunicorn in production).
+    # The reloader is disabled because it would import this module, and create a
+    # second broker, in a separate process.
+    app.run(host='0.0.0.0', port=5000, use_reloader=False)
\ No newline at end of file
@@ -3,14 +3,20 @@ Basic tests for BatchSQSBroker functionality.
 
 These tests focus on the core batching logic and don't require actual AWS SQS connections.
 """
+import json
+import os
+import sys
+import threading
 import time
 import unittest.mock
 from unittest.mock import MagicMock, patch
 
 import pytest
+from botocore.config import Config
 from dramatiq import Message
 
 from batch_sqs_broker import BatchSQSBroker, FailedMessage
+from batch_sqs_broker.broker import QueueConfig
 
 
 class TestBatchSQSBroker:
@@ -50,6 +56,20 @@ class TestBatchSQSBroker:
         assert broker.group_batch_intervals == {"high": 0, "low": 10.0}
         assert broker.group_idle_timeouts == {"high": 0, "low": 1.0}
 
+    def test_sqs_client_uses_tcp_keepalive(self):
+        """Test the SQS client keeps a connection per send thread alive while honouring a custom botocore config."""
+        broker = BatchSQSBroker()
+        assert broker.sqs.meta.client.meta.config.tcp_keepalive is True
+        assert broker.sqs.meta.client.meta.config.max_pool_connections == 10
+
+        broker = BatchSQSBroker(max_concurrent_flushes=16)
+        assert broker.sqs.meta.client.meta.config.max_pool_connections == 16
+
+        broker = BatchSQSBroker(config=Config(max_pool_connections=20))
+        client_config = broker.sqs.meta.client.meta.config
+        assert client_config.tcp_keepalive is True
+        assert client_config.max_pool_connections == 20
+
     def test_batch_size_limited_to_10(self):
         """Test that batch_size is limited to SQS maximum of 10."""
         broker = BatchSQSBroker(batch_size=20)
@@ -67,6 +87,17 @@ class TestBatchSQSBroker:
         large_entry = {"Id": "test", "MessageBody": "x" * (256 * 1024 + 1)}
         assert broker._check_message_size(large_entry) is False
 
+    def test_message_size_counts_utf8_bytes(self):
+        """Test message size is measured in UTF-8 bytes, not characters."""
+        broker = BatchSQSBroker()
+
+        assert broker._message_size({"Id": "test", "MessageBody": "abc"}) == 3
+        assert broker._message_size({"Id": "test", "MessageBody": "\u00e9\u4e2d"}) == 5
+
+        # Fits in 256K characters but not in 256KB
+        multibyte_entry = {"Id": "test", "MessageBody": "\u00e9" * (128 * 1024 + 1)}
+        assert broker._check_message_size(multibyte_entry) is False
+
     def test_failed_message_dataclass(self):
         """Test FailedMessage dataclass functionality."""
         entry = {"Id": "test", "MessageBody": "test"}
@@ -77,6 +108,13 @@ class TestBatchSQSBroker:
         assert isinstance(failed_msg.first_failure_time, float)
         assert isinstance(failed_msg.last_failure_time, float)
 
+    @pytest.mark.skipif(sys.version_info < (3, 10), reason="slotted dataclasses require Python 3.10")
+    def test_failed_message_uses_slots(self):
+        """Test FailedMessage instances carry no per-instance __dict__."""
+        failed_msg = FailedMessage(entry={"Id": "test", "MessageBody": "test"})
+
+        assert not hasattr(failed_msg, "__dict__")
+
     def test_split_oversized_batch_basic(self):
         """Test basic batch splitting functionality."""
         broker = BatchSQSBroker()
@@ -161,6 +199,33 @@ class TestBatchSQSBroker:
         assert status["batch_interval"] == 2.0
         assert status["idle_timeout"] == 0.5
 
+        # Status of a queue that was never used does not fill the config cache
+        assert broker.get_queue_status("unknown_queue")["batch_interval"] == 1.0
+        assert "unknown_queue" not in broker._queue_configs
+
+    def test_queue_config_resolution(self):
+        """Test per-queue settings fall back to defaults and are resolved once."""
+        broker = BatchSQSBroker(
+            default_batch_interval=3.0,
+            default_idle_timeout=0.3,
+            group_batch_intervals={"high": 0},
+            group_idle_timeouts={"high": 0},
+        )
+
+        assert broker._get_queue_config("high") == QueueConfig(batch_interval=0, idle_timeout=0)
+        assert broker._get_queue_config("other") == QueueConfig(batch_interval=3.0, idle_timeout=0.3)
+        assert broker._get_queue_config("high") is broker._get_queue_config("high")
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_is_healthy(self, mock_logger):
+        """Test health reflects the running flag and the background thread."""
+        broker = BatchSQSBroker()
+        assert broker.is_healthy() is True
+
+        broker.flush_all = MagicMock()
+        broker.close()
+        assert broker.is_healthy() is False
+
     @patch('batch_sqs_broker.broker.get_logger')
     def test_clear_queue_buffer(self, mock_logger):
         """Test queue buffer clearing functionality."""
@@ -181,6 +246,67 @@ class TestBatchSQSBroker:
         assert len(broker.buffer["test_queue"]) == 0
         assert len(broker.failed_messages["test_queue"]) == 0
 
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_enqueue_many(self, mock_logger):
+        """Test bulk enqueue buffers every message per queue."""
+        # Long intervals keep the background thread from flushing before the buffers are checked
+        broker = BatchSQSBroker(default_batch_interval=60, default_idle_timeout=60)
+        mock_queue = MagicMock()
+        mock_queue.send_messages.return_value = {}
+        broker.queues["test_queue"] = mock_queue
+        broker.queues["other_queue"] = mock_queue
+
+        messages = [
+            Message(queue_name="test_queue", actor_name="task", args=(i,), kwargs={}, options={})
+            for i in range(3)
+        ]
+        messages.append(Message(queue_name="other_queue", actor_name="task", args=(), kwargs={}, options={}))
+
+        result = broker.enqueue_many(messages)
+
+        assert result == messages
+        assert len(broker.buffer["test_queue"]) == 3
+        assert len(broker.buffer["other_queue"]) == 1
+        assert len({entry["Id"] for entry in broker.buffer["test_queue"]}) == 3
+
+        broker.close()
+        assert mock_queue.send_messages.call_count == 2
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_enqueue_many_sends_unbatched_queue_as_one_batch(self, mock_logger):
+        """Test bulk enqueue to a batch_interval=0 queue sends full batches instead of one per message."""
+        broker = BatchSQSBroker(group_batch_intervals={"urgent": 0})
+        mock_queue = MagicMock()
+        mock_queue.send_messages.return_value = {}
+        broker.queues["urgent"] = mock_queue
+
+        messages = [
+            Message(queue_name="urgent", actor_name="task", args=(i,), kwargs={}, options={})
+            for i in range(10)
+        ]
+        broker.enqueue_many(messages)
+        broker._flush_executor.shutdown(wait=True)
+
+        mock_queue.send_messages.assert_called_once()
+        assert len(mock_queue.send_messages.call_args[1]["Entries"]) == 10
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_enqueue_many_buffer_error_enqueues_nothing(self, mock_logger):
+        """Test bulk enqueue checks every queue's capacity before buffering any message."""
+        broker = BatchSQSBroker(max_buffer_size_per_queue=5)
+        broker.failed_messages["full_queue"] = [
+            FailedMessage(entry={"Id": str(i), "MessageBody": "test"}) for i in range(5)
+        ]
+
+        messages = [Message(queue_name="test_queue", actor_name="task", args=(), kwargs={}, options={})]
+        messages.append(Message(queue_name="full_queue", actor_name="task", args=(), kwargs={}, options={}))
+
+        with pytest.raises(BufferError):
+            broker.enqueue_many(messages)
+
+        assert not broker.buffer.get("test_queue")
+        assert not broker.buffer.get("full_queue")
+
     @patch('batch_sqs_broker.broker.get_logger')
     def test_close_broker(self, mock_logger):
         """Test broker cleanup functionality."""
@@ -200,6 +326,222 @@ class TestBatchSQSBroker:
         mock_thread.join.assert_called_once_with(timeout=5.0)
         broker.flush_all.assert_called_once()
 
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_flush_sends_batches_in_background(self, mock_logger):
+        """Test flushed batches are sent from the send pool and partial failures are queued for retry."""
+        broker = BatchSQSBroker()
+        mock_queue = MagicMock()
+        mock_queue.send_messages.return_value = {"Failed": [{"Id": "2"}]}
+        broker.queues["test_queue"] = mock_queue
+
+        broker.buffer["test_queue"] = [
+            {"Id": "1", "MessageBody": "test1"},
+            {"Id": "2", "MessageBody": "test2"},
+        ]
+        broker.force_flush_queue("test_queue")
+        broker._flush_executor.shutdown(wait=True)
+
+        mock_queue.send_messages.assert_called_once()
+        assert broker.metrics["messages_sent"]["test_queue"] == 1
+        assert broker.metrics["messages_failed"]["test_queue"] == 1
+        assert [msg.entry["Id"] for msg in broker.failed_messages["test_queue"]] == ["2"]
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_flush_send_error_queues_batch_for_retry(self, mock_logger):
+        """Test a batch that raises while sending is queued for retry instead of blocking the broker."""
+        broker = BatchSQSBroker()
+        mock_queue = MagicMock()
+        mock_queue.send_messages.side_effect = Exception("SQS unavailable")
+        broker.queues["test_queue"] = mock_queue
+
+        broker.buffer["test_queue"] = [{"Id": "1", "MessageBody": "test1"}]
+        broker.force_flush_queue("test_queue")
+        broker._flush_executor.shutdown(wait=True)
+
+        assert broker.metrics["messages_failed"]["test_queue"] == 1
+        assert len(broker.failed_messages["test_queue"]) == 1
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_buffer_limit_counts_pending_sends(self, mock_logger):
+        """Test batches waiting for a slow SQS count toward max_buffer_size_per_queue."""
+        broker = BatchSQSBroker(max_buffer_size_per_queue=20, max_concurrent_flushes=1)
+        release_send = threading.Event()
+
+        def blocking_send(**kwargs):
+            release_send.wait(5)
+            return {}
+
+        mock_queue = MagicMock()
+        mock_queue.send_messages.side_effect = blocking_send
+        broker.queues["test_queue"] = mock_queue
+        message = Message(queue_name="test_queue", actor_name="test_actor", args=(), kwargs={}, options={})
+
+        for _ in range(20):
+            broker.enqueue(message)
+        with pytest.raises(BufferError):
+            broker.enqueue(message)
+
+        assert broker.metrics["buffer_overflow_count"]["test_queue"] == 1
+        release_send.set()
+        broker.close()
+        assert broker._pending_counts["test_queue"] == 0
+        assert broker.metrics["messages_sent"]["test_queue"] == 20
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_unbatched_queue_bypasses_buffer(self, mock_logger):
+        """Test messages for queues with batch_interval=0 are sent without being buffered."""
+        broker = BatchSQSBroker(group_batch_intervals={"urgent": 0})
+        broker._send_to_sqs = MagicMock()
+        broker._flush = MagicMock()
+
+        message = Message(queue_name="urgent", actor_name="send_email", args=(), kwargs={}, options={})
+        broker.enqueue(message)
+        broker._flush_executor.shutdown(wait=True)
+
+        broker._send_to_sqs.assert_called_once()
+        queue_name, entries = broker._send_to_sqs.call_args[0]
+        assert queue_name == "urgent"
+        assert len(entries) == 1
+        broker._flush.assert_not_called()
+        assert broker.buffer["urgent"] == []
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_background_flush_after_idle_timeout(self, mock_logger):
+        """Test the background thread flushes a queue once its idle timeout expires."""
+        broker = BatchSQSBroker(default_batch_interval=10.0, default_idle_timeout=0.05)
+        broker._send_to_sqs = MagicMock()
+
+        message = Message(queue_name="test_queue", actor_name="task", args=(), kwargs={}, options={})
+        broker.enqueue(message)
+
+        deadline = time.time() + 2.0
+        while not broker._send_to_sqs.called and time.time() < deadline:
+            time.sleep(0.01)
+
+        broker._send_to_sqs.assert_called_once()
+        queue_name, entries = broker._send_to_sqs.call_args[0]
+        assert queue_name == "test_queue"
+        assert len(entries) == 1
+        assert broker.buffer["test_queue"] == []
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_close_wakes_idle_background_thread(self, mock_logger):
+        """Test close() stops an idle background thread without waiting for the join timeout."""
+        broker = BatchSQSBroker()
+        broker.flush_all = MagicMock()
+        thread = broker._background_thread
+
+        start = time.time()
+        broker.close()
+
+        assert not thread.is_alive()
+        assert time.time() - start < 1.0
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_close_after_send_pool_shutdown(self, mock_logger):
+        """Test close() still sends buffered messages when the send pool was already shut down (e.g. from atexit)."""
+        broker = BatchSQSBroker()
+        mock_queue = MagicMock()
+        mock_queue.send_messages.return_value = {}
+        broker.queues["test_queue"] = mock_queue
+        broker.buffer["test_queue"] = [{"Id": "1", "MessageBody": "test1"}]
+
+        broker._flush_executor.shutdown(wait=True)
+        broker.close()
+
+        mock_queue.send_messages.assert_called_once()
+        assert broker.metrics["messages_sent"]["test_queue"] == 1
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_close_is_idempotent_and_sends_later_messages(self, mock_logger):
+        """Test a second close() is a no-op and messages enqueued after closing are sent right away."""
+        broker = BatchSQSBroker()
+        mock_queue = MagicMock()
+        mock_queue.send_messages.return_value = {}
+        broker.queues["test_queue"] = mock_queue
+        broker.close()
+
+        broker.flush_all = MagicMock()
+        broker.close()
+        broker.flush_all.assert_not_called()
+
+        broker.enqueue(Message(queue_name="test_queue", actor_name="test_actor", args=(), kwargs={}, options={}))
+
+        mock_queue.send_messages.assert_called_once()
+        assert broker.buffer["test_queue"] == []
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_forceful_shutdown_dumps_unsent_messages(self, mock_logger, tmp_path):
+        """Test forceful shutdown writes buffered, failed and not yet sent messages to the dump file."""
+        broker = BatchSQSBroker(max_concurrent_flushes=1)
+        send_started = threading.Event()
+        release_send = threading.Event()
+
+        def blocking_send(**kwargs):
+            send_started.set()
+            release_send.wait(5)
+            return {}
+
+        mock_queue = MagicMock()
+        mock_queue.send_messages.side_effect = blocking_send
+        broker.queues["test_queue"] = mock_queue
+
+        # The first batch occupies the only sender, the second one waits in the pool
+        broker.buffer["test_queue"] = [{"Id": "sending", "MessageBody": "test"}]
+        broker.force_flush_queue("test_queue")
+        assert send_started.wait(5)
+        broker.buffer["test_queue"] = [{"Id": "pending", "MessageBody": "test"}]
+        broker.force_flush_queue("test_queue")
+
+        broker.buffer["test_queue"] = [{"Id": "buffered", "MessageBody": "test"}]
+        broker.failed_messages["test_queue"] = [FailedMessage(entry={"Id": "failed", "MessageBody": "test"})]
+
+        dump_path = broker.forceful_shutdown(dump_path=str(tmp_path / "dump.jsonl"))
+        release_send.set()
+
+        assert broker._running is False
+        with open(dump_path) as f:
+            lines = [json.loads(line) for line in f]
+        assert sorted(line["entry"]["Id"] for line in lines) == ["buffered", "failed", "pending"]
+        assert all(line["queue_name"] == "test_queue" for line in lines)
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_forceful_shutdown_without_messages(self, mock_logger):
+        """Test forceful shutdown writes no dump file when nothing is left to send."""
+        broker = BatchSQSBroker()
+
+        assert broker.forceful_shutdown() is None
+        assert broker.is_healthy() is False
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_forceful_shutdown_never_sends_dumped_messages(self, mock_logger):
+        """Test messages dumped by a forceful shutdown are not sent by later enqueues, flushes or close()."""
+        broker = BatchSQSBroker()
+        mock_queue = MagicMock()
+        mock_queue.send_messages.return_value = {}
+        broker.queues["test_queue"] = mock_queue
+        message = Message(queue_name="test_queue", actor_name="test_actor", args=(), kwargs={}, options={})
+        for _ in range(3):
+            broker.enqueue(message)
+
+        dump_path = broker.forceful_shutdown()
+        try:
+            with open(dump_path) as f:
+                assert len(f.readlines()) == 3
+            assert os.path.basename(dump_path).startswith(f"batch_sqs_broker_dump_{os.getpid()}_")
+
+            with pytest.raises(RuntimeError):
+                broker.enqueue(message)
+            with pytest.raises(RuntimeError):
+                broker.enqueue_many([message])
+            broker.flush_all()
+            broker.close()
+
+            mock_queue.send_messages.assert_not_called()
+            assert broker.buffer == {}
+        finally:
+            os.remove(dump_path)
+
 
 class TestFailedMessageRetry:
     """Test suite for failed message retry logic."""
@@ -264,6 +606,57 @@ class TestFailedMessageRetry:
         assert len(broker.buffer["test_queue"]) == 0
         assert len(broker.failed_messages["test_queue"]) == 1  # Still in failed queue
 
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_retry_logic_partitions_mixed_messages(self, mock_logger):
+        """Test retry, drop and wait decisions are applied to each message independently."""
+        broker = BatchSQSBroker(max_retry_attempts=2)
+
+        due = FailedMessage(entry={"Id": "due", "MessageBody": "same"}, retry_count=1)
+        due.last_failure_time = time.time() - 3
+        waiting = FailedMessage(entry={"Id": "waiting", "MessageBody": "same"}, retry_count=1)
+        exhausted = FailedMessage(entry={"Id": "exhausted", "MessageBody": "same"}, retry_count=2)
+
+        broker.failed_messages["test_queue"] = [due, waiting, exhausted]
+        broker.buffer["test_queue"] = []
+
+        broker._retry_failed_messages("test_queue")
+
+        assert [entry["Id"] for entry in broker.buffer["test_queue"]] == ["due"]
+        assert broker.failed_messages["test_queue"] == [waiting]
+        assert due.retry_count == 2
+        assert broker.metrics["retry_exhausted_count"]["test_queue"] == 1
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_retry_logic_returns_next_retry_time(self, mock_logger):
+        """Test the earliest retry time of the remaining failed messages is returned."""
+        broker = BatchSQSBroker()
+
+        first = FailedMessage(entry={"Id": "1", "MessageBody": "test"}, retry_count=2, last_failure_time=100.0)
+        second = FailedMessage(entry={"Id": "2", "MessageBody": "test"}, retry_count=1, last_failure_time=time.time())
+        broker.failed_messages["test_queue"] = [first, second]
+        broker.buffer["test_queue"] = []
+
+        assert broker._retry_failed_messages("test_queue") == second.last_failure_time + 2
+        assert broker._retry_failed_messages("empty_queue") is None
+
+    @patch('batch_sqs_broker.broker.get_logger')
+    def test_background_skips_queues_until_retry_time(self, mock_logger):
+        """Test failed messages are not rescanned before their earliest retry time."""
+        broker = BatchSQSBroker()
+
+        failed_msg = FailedMessage(entry={"Id": "1", "MessageBody": "test"}, last_failure_time=time.time())
+        broker.failed_messages["test_queue"] = [failed_msg]
+        broker.buffer["test_queue"] = []
+
+        with broker.lock:
+            timeout = broker._flush_due_queues()
+            assert 0 < timeout <= 1.0
+            assert broker._next_retry_times["test_queue"] == failed_msg.last_failure_time + 1
+
+            broker._retry_failed_messages = MagicMock()
+            broker._flush_due_queues()
+            broker._retry_failed_messages.assert_not_called()
+
 
 if __name__ == "__main__":
     pytest.main([__file__])
\ No newline at end of file